@@ -1,12 +1,12 @@
 
 # Example of assay metadata input form (Streamlit web application)
 
-from io import StringIO
+from io import BytesIO
+import json
 from pathlib import Path
 import re
 import uuid
 
-import numpy as np
 import pandas as pd
 import streamlit as st
 import yaml
@@ -20,6 +20,11 @@ from assay_spec_utils.util import is_convertible_to_int, is_convertible_to_float
 
 TEMPLATES_DIR = Path("./templates")
 ATTRIBUTES_DIR = Path("./attributes")
+TEMPLATE_FILES = ["binding", "enzyme", "reporter", "viability"]
+
+# libyaml bindings are used if available
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+YamlDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
 
 # yaml literal format
 # https://stackoverflow.com/questions/6432605/any-yaml-libraries-in-python-that-support-dumping-of-long-strings-as-block-liter
@@ -27,9 +32,25 @@ ATTRIBUTES_DIR = Path("./attributes")
 class literal_str(str): pass
 
 def literal_str_representer(dumper, data):
-    return dumper.represent_scalar(u'tag:yaml.org,2002:str', data, style='|')
+    return dumper.represent_scalar(u'tag:yaml.org,2002:str', str(data), style='|')
+
+
+# Tuple fields (terms, parameters, readoutRange) and layerIndices are emitted
+# in flow style (e.g. [pH, equilibration, 7.4, null])
+
+class ProtocolDumper(YamlDumper):
+    def represent_flow_sequence(self, data):
+        return self.represent_sequence(
+            u'tag:yaml.org,2002:seq', data, flow_style=True)
 
-yaml.add_representer(literal_str, literal_str_representer)
+    def represent_dict(self, data):
+        if "layerIndices" in data:
+            data = {**data, "layerIndices": tuple(data["layerIndices"])}
+        return super().represent_dict(data)
+
+ProtocolDumper.add_representer(dict, ProtocolDumper.represent_dict)
+ProtocolDumper.add_representer(tuple, ProtocolDumper.represent_flow_sequence)
+ProtocolDumper.add_representer(literal_str, literal_str_representer)
 
 
 # TODO: min and max values
@@ -55,34 +76,67 @@ PARAM_TYPE_OPTIONS = [
     dict(name="string", type=str, units=None)
 ]
 PARAM_TYPE_DICT = {r["name"]: r for r in PARAM_TYPE_OPTIONS}
+PARAM_TYPE_NAMES = tuple(PARAM_TYPE_DICT)
+PARAM_UNITS = tuple(dict.fromkeys(
+    u for r in PARAM_TYPE_OPTIONS for u in r["units"] or []))
+PARAM_COLUMNS = ["type", "name", "value", "unit"]
+
+VALUE_TYPE_OPTIONS = ("percentage", "AC50", "RZ-score")
+VALUE_TYPE_INDEX = {n: i for i, n in enumerate(VALUE_TYPE_OPTIONS)}
+
+# Comma separated session IDs
+SESSION_ID_RE = re.compile(r"[^,\s]+")
 
 
 # Main logics
 
-def template_options() -> list:
+@st.cache_data(show_spinner=False)
+def _template_options(mtime_key) -> list:
     templates = []
-    files = ["binding", "enzyme", "reporter", "viability"]
-    for f in files:
+    for f in TEMPLATE_FILES:
         templates.extend(parse_spec_file(
             TEMPLATES_DIR / f"{f}.yaml", AssayTemplates, exclude_unset=True)["items"])
     return templates
 
 
-def attribute_options(attr: str) -> dict:
+def template_options() -> list:
+    # file modification times are passed to invalidate the cache
+    mtime_key = tuple(
+        (TEMPLATES_DIR / f"{f}.yaml").stat().st_mtime for f in TEMPLATE_FILES)
+    return _template_options(mtime_key)
+
+
+@st.cache_data(show_spinner=False)
+def _attribute_options(attr: str, mtime_key) -> dict:
     return parse_spec_file(
         ATTRIBUTES_DIR / f"{attr}.yaml", AssayAttributes)["items"]
 
 
+def attribute_options(attr: str) -> dict:
+    mtime_key = (ATTRIBUTES_DIR / f"{attr}.yaml").stat().st_mtime
+    return _attribute_options(attr, mtime_key)
+
+
+@st.cache_data(show_spinner=False)
+def build_protocol(payload_json: str) -> dict:
+    return AssayProtocol.model_validate_json(
+        payload_json).model_dump(exclude_unset=True)
+
+
 def load_template(saved_file, tmpl):
     if saved_file is not None:
-        st.session_state["data"] = yaml.safe_load(saved_file)
+        data = yaml.load(saved_file, Loader=YamlLoader)
+        # targets are keyed by stable IDs while editing
+        data["targets"] = {
+            uuid.uuid4().hex: t for t in data.get("targets", [])}
+        st.session_state["data"] = data
     elif tmpl is not None:
         st.session_state["data"] = {
             "assayProtocolVersion": "1.0",
             "meta": {
                 "description": ""
             },
-            "targets": [],
+            "targets": {},
             "attributes": tmpl.get("attributes", []),
             "terms": tmpl.get("terms", []),
             "parameters": tmpl.get("parameters", []),
@@ -94,22 +148,19 @@ def load_template(saved_file, tmpl):
 
 
 def add_target():
-    st.session_state["data"]["targets"].append(
-        {"sourceType": "UniProt", "accessionId": ""})
+    st.session_state["data"]["targets"][uuid.uuid4().hex] = {
+        "sourceType": "UniProt", "accessionId": ""}
     clear_generated()
 
 
-def update_targets():
-    new_targets = []
-    for i, rcd in enumerate(st.session_state["data"]["targets"]):
-        tid = st.session_state[f"tid_{i}"]
-        new_targets.append({"sourceType": "UniProt", "accessionId": tid})
-    st.session_state["data"]["targets"] = new_targets
+def update_target(tid):
+    st.session_state["data"]["targets"][tid] = {
+        "sourceType": "UniProt", "accessionId": st.session_state[f"tid_{tid}"]}
     clear_generated()
 
 
-def remove_target(idx):
-    st.session_state["data"]["targets"].pop(idx)
+def remove_target(tid):
+    del st.session_state["data"]["targets"][tid]
     clear_generated()
 
 
@@ -120,76 +171,77 @@ def update_attributes():
     clear_generated()
 
 
-def add_parameter():
-    st.session_state["data"]["parameters"].append(
-        ["string", "New parameter", "", None])
-    clear_generated()
-
-
-def update_parameters():
-    new_params = []
-    for i, rcd in enumerate(st.session_state["data"]["parameters"]):
-        pcat = st.session_state[f"pcat_{i}"]
-        p = PARAM_TYPE_DICT[pcat]
-        pname = st.session_state[f"pname_{i}"]
-        pval = st.session_state[f"pval_{i}"]
-        punit = st.session_state.get(f"punit_{i}")
-        # set default values and units for the selected category
-        if p["type"] is int and not is_convertible_to_int(pval):
-            pval = 0
-        elif p["type"] is float and not is_convertible_to_float(pval):
-            pval = 0.0
-        if p["units"] is None:
-            punit = None
-        elif punit not in p["units"]:
-            punit = p["units"][0]
-        new_params.append([pcat, pname, pval, punit])
-    st.session_state["data"]["parameters"] = new_params
-    clear_generated()
-
-
-def remove_parameter(idx):
-    st.session_state["data"]["parameters"].pop(idx)
+def normalize_parameter(pcat, pname, pval, punit):
+    p = PARAM_TYPE_DICT[pcat]
+    if pval is None:
+        pval = ""
+    # set default values and units for the selected category
+    if p["type"] is int:
+        pval = int(pval) if is_convertible_to_int(pval) else 0
+    elif p["type"] is float:
+        pval = float(pval) if is_convertible_to_float(pval) else 0.0
+    if p["units"] is None:
+        punit = None
+    elif punit not in p["units"]:
+        punit = p["units"][0]
+    return [pcat, pname, pval, punit]
+
+
+def update_parameters_df(key):
+    # apply only changed rows reported by the data editor
+    changes = st.session_state[key]
+    params = st.session_state["data"]["parameters"]
+    for idx, row in changes["edited_rows"].items():
+        rcd = list(params[idx])
+        for col, value in row.items():
+            rcd[PARAM_COLUMNS.index(col)] = value
+        params[idx] = normalize_parameter(*rcd)
+    for idx in sorted(changes["deleted_rows"], reverse=True):
+        params.pop(idx)
+    for row in changes["added_rows"]:
+        params.append(normalize_parameter(
+            row.get("type") or "string", row.get("name") or "New parameter",
+            row.get("value"), row.get("unit")))
+    # recreate the editor from the updated parameters
+    st.session_state["params_editor_ver"] = \
+        st.session_state.get("params_editor_ver", 0) + 1
     clear_generated()
 
 
 def add_assay():
-    st.session_state["data"]["assays"].append({
+    data = st.session_state["data"]
+    data["assays"].append({
         "assayId": "primary",
         "valueType": "percentage",
         "datasources": [{
             "sourceType": "Screener",
             "sessionId": "",
-            "layerIndices": [None for _ in st.session_state["data"]["readouts"]]
+            "layerIndices": [None for _ in data["readouts"]]
         }]
     })
     clear_generated()
 
 
-def update_assays():
-    new_assays = []
-    for i, rcd in enumerate(st.session_state["data"]["assays"]):
-        apid = st.session_state[f"apid_{i}"]
-        aid = st.session_state[f"aid_{i}"]
-        avtype = st.session_state[f"avtype_{i}"]
-        asids = st.session_state[f"asid_{i}"]
-        pval = st.session_state[f"pval_{i}"]
-        assay = {
-            "assayId": aid, 
-            "valueType": avtype,
-            "datasources": []
-        }
-        alys = []
-        for j, readout in enumerate(st.session_state["data"]["readouts"]):
-            alys.append(st.session_state[f"aly_{i}_{j}"])
-        for sid in asids.split(","):
-            assay["datasources"].append({
-                "sourceType": "Screener",
-                "sessionId": sid.strip(),
-                "layerIndices": alys
-            })
-        new_assays.append(assay)
-    st.session_state["data"]["assays"] = new_assays
+def update_assay(idx):
+    aid = st.session_state[f"aid_{idx}"]
+    avtype = st.session_state[f"avtype_{idx}"]
+    asids = st.session_state[f"asid_{idx}"]
+    assay = {
+        "assayId": aid,
+        "valueType": avtype,
+        "datasources": []
+    }
+    alys = [
+        st.session_state[f"aly_{idx}_{j}"]
+        for j in range(len(st.session_state["data"]["readouts"]))]
+    # keep an empty datasource to hold layer settings
+    for sid in SESSION_ID_RE.findall(asids) or [""]:
+        assay["datasources"].append({
+            "sourceType": "Screener",
+            "sessionId": sid,
+            "layerIndices": alys
+        })
+    st.session_state["data"]["assays"][idx] = assay
     clear_generated()
 
 
@@ -203,29 +255,12 @@ def update_description():
     clear_generated()
 
 
-def customize_yaml_style(yaml_dump, layer_cnt):
-    # YAML style hack
-    idt4list = "    - (.+?)"
-    idt2list = "  - (.+?)"
-    idt2list4 = "\n".join(idt2list for _ in range(4))
-    idt4list4 = "\n".join(idt4list for _ in range(4))
-    idt2list2 = "\n".join(idt2list for _ in range(2))
-    idt4list2 = "\n".join(idt4list for _ in range(2))
-    idt4listn = "\n".join(idt4list for _ in range(layer_cnt))
-    rep4 = ", ".join(fr"\{i}" for i in range(1, 5))
-    rep2 = ", ".join(fr"\{i}" for i in range(1, 3))
-    repn = ", ".join(fr"\{i}" for i in range(1, layer_cnt + 1))
-    yaml_dump = re.sub(
-        fr"- !!python/tuple\n{idt2list4}\n", fr"- [{rep4}]\n", yaml_dump)
-    yaml_dump = re.sub(
-        fr"- !!python/tuple\n{idt4list4}\n", fr"- [{rep4}]\n", yaml_dump)
-    yaml_dump = re.sub(
-        fr"- !!python/tuple\n{idt2list2}\n", fr"- [{rep2}]\n", yaml_dump)
-    yaml_dump = re.sub(
-        fr"- !!python/tuple\n{idt4list2}\n", fr"- [{rep2}]\n", yaml_dump)
-    yaml_dump = re.sub(
-        fr"  layerIndices:\n{idt4listn}\n", fr"  layerIndices: [{repn}]\n", yaml_dump)
-    return yaml_dump
+def first_match_index(attr, mp):
+    """Index of the first key in mp found in attr (0 if not found)"""
+    for i, k in enumerate(mp):
+        if k in attr:
+            return i
+    return 0
 
 
 def clear_generated():
@@ -261,46 +296,47 @@ def run():
             st.write("to discard changes and start from a loaded file or a new template")
     if not st.session_state.get("data"):
         return
+    data = st.session_state["data"]
+    readouts = data["readouts"]
 
 
     st.markdown("""## Assay design""")
 
     # Targets
-    for i, rcd in enumerate(st.session_state["data"]["targets"]):
+    for tid, rcd in data["targets"].items():
         col1, col2, col3 = st.columns([1, 1, 2])
         with col1:
             st.text_input(
                 "Target UniProt Accession ID", value=rcd["accessionId"],
-                key=f"tid_{i}", on_change=update_targets)
+                key=f"tid_{tid}", on_change=update_target, args=[tid])
         with col2:
-            st.button("🗑️", key=f"tdel_{i}", on_click=remove_target, args=[i])
+            st.button(
+                "🗑️", key=f"tdel_{tid}", on_click=remove_target, args=[tid])
     st.button("Add a target", on_click=add_target)
 
     # Attributes
-    attr = st.session_state["data"]["attributes"]
+    attr = set(data["attributes"])
     cat_ops = attribute_options("assay_category")
     cat_map = {rcd["attributeId"]: rcd for rcd in cat_ops}
-    cat = list(set(attr) & set(cat_map.keys()))
-    cat_idx = list(cat_map.keys()).index(cat[0]) if cat else 0
+    cat_idx = first_match_index(attr, cat_map)
     st.selectbox("Assay category", cat_map.keys(),
         key="cat", index=cat_idx, format_func=lambda k: cat_map[k]["name"],
         on_change=update_attributes)
     plate_ops = attribute_options("microplate")
     plate_map = {rcd["attributeId"]: rcd for rcd in plate_ops}
-    plate = list(set(attr) & set(plate_map.keys()))
-    plate_idx = list(plate_map.keys()).index(plate[0]) if plate else 0
+    plate_idx = first_match_index(attr, plate_map)
     st.selectbox("Microplate", plate_map.keys(),
         key="plate", index=plate_idx, format_func=lambda k: plate_map[k]["name"],
         on_change=update_attributes)
     atag_ops = attribute_options("affinity_tag")
     atag_map = {rcd["attributeId"]: rcd for rcd in atag_ops}
-    atags = list(set(attr) & set(atag_map.keys()))
+    atags = [k for k in atag_map if k in attr]
     st.multiselect("Affinity tags", atag_map.keys(),
         default=atags, key="atag", format_func=lambda k: atag_map[k]["name"],
         on_change=update_attributes)
     reagent_ops = attribute_options("reagent")
     reagent_map = {rcd["attributeId"]: rcd for rcd in reagent_ops}
-    reagents = list(set(attr)& set(reagent_map.keys()))
+    reagents = [k for k in reagent_map if k in attr]
     st.multiselect("Mediums/premixed reagents", reagent_map.keys(),
         default=reagents, key="reagent",
         format_func=lambda k: reagent_map[k]["name"],
@@ -309,41 +345,22 @@ def run():
 
     st.markdown("""## Assay conditions""")
 
-    for i, rcd in enumerate(st.session_state["data"]["parameters"]):
-        col1, col2, col3, col4, col5 = st.columns([3, 3, 3, 3, 1])
-        ptype_opts = list(PARAM_TYPE_DICT.keys())
-        vtype = PARAM_TYPE_DICT[rcd[0]]["type"]
-        with col1:
-            st.selectbox(
-                "Type", ptype_opts, index=ptype_opts.index(rcd[0]),
-                key=f"pcat_{i}", on_change=update_parameters)
-        with col2:
-            st.text_input(
-                "Name", value=rcd[1], key=f"pname_{i}",
-                on_change=update_parameters)
-        with col3:
-            if vtype is int:
-                st.number_input(
-                    "Value", value=int(rcd[2]), key=f"pval_{i}", step=1,
-                    on_change=update_parameters)
-            elif vtype is float:
-                st.number_input(
-                    "Value", value=float(rcd[2]), key=f"pval_{i}",
-                    on_change=update_parameters)
-            elif vtype is str:
-                st.text_input(
-                    "Value", value=str(rcd[2]), key=f"pval_{i}",
-                    on_change=update_parameters)
-        with col4:
-            punit_opts = PARAM_TYPE_DICT[rcd[0]]["units"]
-            if punit_opts is not None:
-                st.selectbox(
-                    "Unit", punit_opts, index=punit_opts.index(rcd[3]),
-                    key=f"punit_{i}")
-        with col5:
-            st.button(
-                "🗑️", key=f"pdel_{i}", on_click=remove_parameter, args=[i])
-    st.button("Add a parameter", on_click=add_parameter)
+    params_df = pd.DataFrame(
+        [[c, n, None if v is None else str(v), u]
+         for c, n, v, u in data["parameters"]],
+        columns=PARAM_COLUMNS)
+    params_key = f"params_editor_{st.session_state.get('params_editor_ver', 0)}"
+    st.data_editor(
+        params_df, key=params_key, num_rows="dynamic", hide_index=True,
+        use_container_width=True, on_change=update_parameters_df,
+        args=[params_key], column_config={
+            "type": st.column_config.SelectboxColumn(
+                "Type", options=PARAM_TYPE_NAMES, required=True),
+            "name": st.column_config.TextColumn("Name", required=True),
+            "value": st.column_config.TextColumn("Value"),
+            "unit": st.column_config.SelectboxColumn(
+                "Unit", options=PARAM_UNITS)
+        })
 
 
     st.markdown("""## Protocol descriptions and comments""")
@@ -353,7 +370,7 @@ def run():
         "Assay protocol ID", value=default_pid, key="protocol_id")
     st.text_area(
             "Description", key="description",
-            value=st.session_state["data"]["meta"]["description"],
+            value=data["meta"]["description"],
             height=150, on_change=update_description,
             placeholder="""e.g.
 - Protein sample details (affinitiy tags, mutations, isoform, sequence)
@@ -364,8 +381,7 @@ def run():
 
     st.markdown("""## Data source""")
 
-    vtype_opts = ["percentage", "AC50", "RZ-score"]
-    for i, rcd in enumerate(st.session_state["data"]["assays"]):
+    for i, rcd in enumerate(data["assays"]):
         col1, col2 = st.columns(2)
         default_sessions = ",".join(d["sessionId"] for d in rcd["datasources"])
         # For simplicity, all sessions are assumed to have the same layer settings
@@ -374,25 +390,25 @@ def run():
             st.text_input(
                 "Assay ID", value=f"{protocol_id}_", disabled=True,
                 label_visibility="hidden", key=f"apid_{i}",
-                on_change=update_assays)
+                on_change=update_assay, args=[i])
         with col2:
             st.text_input(
                 "Assay ID", value=rcd["assayId"], key=f"aid_{i}",
-                on_change=update_assays)
+                on_change=update_assay, args=[i])
         st.selectbox(
-            "Value type", vtype_opts,
-            index=vtype_opts.index(rcd["valueType"]), key=f"avtype_{i}",
-            on_change=update_assays)
+            "Value type", VALUE_TYPE_OPTIONS,
+            index=VALUE_TYPE_INDEX[rcd["valueType"]], key=f"avtype_{i}",
+            on_change=update_assay, args=[i])
         st.text_input(
             "Analyzer Session IDs (Comma separated)",
             value=default_sessions, key=f"asid_{i}",
-            on_change=update_assays)
-        for j, readout in enumerate(st.session_state["data"]["readouts"]):
+            on_change=update_assay, args=[i])
+        for j, readout in enumerate(readouts):
             st.number_input(
                 f"Layer index of {readout["readoutId"]} (1-based)",
                 min_value=1, max_value=20, step=1,
                 key=f"aly_{i}_{j}", value=default_layers[j],
-                on_change=update_assays)
+                on_change=update_assay, args=[i])
     st.button("Add an assay", on_click=add_assay)
 
 
@@ -401,12 +417,21 @@ def run():
     st.button("Generate assay metadata", type="primary", on_click=set_generated)
     if not st.session_state.get("generated"):
         return
-    data = AssayProtocol(**st.session_state["data"]).model_dump(exclude_unset=True)
-    st.write(data)  # display data and check
-    dp = customize_yaml_style(
-        yaml.dump(data, sort_keys=False), len(st.session_state["data"]["readouts"]))
+    payload = {
+        **data,
+        "targets": list(data["targets"].values())
+    }
+    protocol = build_protocol(json.dumps(payload, default=str))
+    desc = data["meta"].get("description")
+    if isinstance(desc, literal_str):
+        # literal style is lost in JSON serialization
+        protocol["meta"]["description"] = desc
+    st.write(protocol)  # display data and check
+    dp = BytesIO()
+    yaml.dump(
+        protocol, dp, Dumper=ProtocolDumper, sort_keys=False, encoding="utf-8")
     st.download_button(
-        "Export YAML file", dp, file_name=f"{protocol_id}.yaml",
+        "Export YAML file", dp.getvalue(), file_name=f"{protocol_id}.yaml",
         mime="application/yaml")
 
 
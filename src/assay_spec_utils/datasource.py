@@ -1,8 +1,12 @@
 
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 
-import requests
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
 
 # External resources
@@ -14,15 +18,36 @@ EBI_BASE_URL = "https://www.ebi.ac.uk/ols4/api/ontologies/"
 # PUG REST API (PubChem)
 PUG_BASE_URL = "https://pubchem.ncbi.nlm.nih.gov/rest/pug/"
 
+# Max number of concurrent requests to the web APIs
+MAX_WORKERS = 16
 
-def uniprot_target_terms(accession_id: str) -> tuple[dict, dict]:
-    """Retrieve target GO and ChEBI terms from UniProt by accession ID
+
+@lru_cache(maxsize=None)
+def _http_session():
+    """HTTP session shared by API calls to reuse connections
+
+    requests is imported on first use to keep the import of this module light.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    # Enough connections per host for MAX_WORKERS concurrent requests
+    session.mount("https://", HTTPAdapter(pool_maxsize=MAX_WORKERS))
+    return session
+
+
+@lru_cache(maxsize=1024)
+def uniprot_target_term_ids(accession_id: str) -> tuple[dict, dict]:
+    """Retrieve target GO and ChEBI term IDs and GO term names from UniProt
+
+    ChEBI term names are not fetched (see chebi_names).
+    Results are cached and shared between callers, so do not modify them.
     """
-    r = requests.get(f"{UNIPROT_BASE_URL}{accession_id}.json")
-    res = r.json()
+    r = _http_session().get(f"{UNIPROT_BASE_URL}{accession_id}.json")
+    res = json_loads(r.content)
 
     termids = {"Function": [], "Process": [], "Component": [], "ChEBI": []}
-    term_name = {}  # term ID => term name
+    go_name = {}  # GO term ID => term name
     # target reactions
     for rcd in res["comments"]:
         if rcd["commentType"] == "CATALYTIC ACTIVITY":
@@ -31,15 +56,11 @@ def uniprot_target_terms(accession_id: str) -> tuple[dict, dict]:
             for r in rcd["reaction"]["reactionCrossReferences"]:
                 if r["database"] == "ChEBI":
                     termids["ChEBI"].append(r["id"])
-                    if r["id"] not in term_name:
-                        term_name[r["id"]] = chebi_name(r["id"])
         elif rcd["commentType"] == "COFACTOR":
             for r in rcd["cofactors"]:
                 cof = r["cofactorCrossReference"]
                 if cof["database"] == "ChEBI":
                     termids["ChEBI"].append(cof["id"])
-                    if cof["id"] not in term_name:
-                        term_name[cof["id"]] = chebi_name(cof["id"])
     # target GO terms
     for rcd in res["uniProtKBCrossReferences"]:
         if rcd["database"] != "GO":
@@ -50,28 +71,51 @@ def uniprot_target_terms(accession_id: str) -> tuple[dict, dict]:
         got, term = r.split(":")[:2]
         gotype = {"F": "Function", "P": "Process", "C": "Component"}[got]
         termids[gotype].append(rcd["id"])
-        if rcd["id"] not in term_name:
-            term_name[rcd["id"]] = " ".join(term.splitlines())
+        if rcd["id"] not in go_name:
+            go_name[rcd["id"]] = " ".join(term.splitlines())
+    return termids, go_name
+
+
+@lru_cache(maxsize=1024)
+def uniprot_target_terms(accession_id: str) -> tuple[dict, dict]:
+    """Retrieve target GO and ChEBI terms from UniProt by accession ID
+
+    Results are cached and shared between callers, so do not modify them.
+    """
+    termids, go_name = uniprot_target_term_ids(accession_id)
+    term_name = chebi_names(termids["ChEBI"])  # term ID => term name
+    term_name.update(go_name)
     return termids, term_name
 
 
+def chebi_names(obo_ids) -> dict:
+    """Fetch ChEBI names of unique IDs in parallel (ID => name)"""
+    obo_ids = list(dict.fromkeys(obo_ids))
+    if not obo_ids:
+        return {}
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+        return dict(zip(obo_ids, ex.map(chebi_name, obo_ids)))
+
+
+@lru_cache(maxsize=4096)
 def chebi_name(obo_id: str) -> str:
     """find chebi name label by obo_id (e.g. CHEBI:53438)
     """
     obo_num = obo_id.split(":")[1]
     query = f"{EBI_BASE_URL}chebi/terms/http%253A%252F%252Fpurl.obolibrary.org%252Fobo%252FCHEBI_{obo_num}"
-    res = requests.get(query).json()
+    res = json_loads(_http_session().get(query).content)
     return res["label"]
 
 
 def pubchem_assay(aid: str):
     query = f"{PUG_BASE_URL}/assay/aid/{aid}/concise/CSV"
-    res = requests.get(query).json()
+    res = json_loads(_http_session().get(query).content)
     return res["label"]
 
 
 def load_table(spec, base_dir: Path, **pd_kwargs):
     """load dataset from a local CSV file"""
+    import pandas as pd
     assert spec["sourceType"] == "CSV"
     df = pd.read_csv(base_dir / spec["sourcePath"], **pd_kwargs)
     df.set_index(spec["sampleIdColumn"])
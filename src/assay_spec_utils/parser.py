@@ -1,11 +1,17 @@
 
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+from itertools import chain
 import logging
+import os
 from pathlib import Path
 import pickle
 
+from pydantic import TypeAdapter
 import yaml
 
-from assay_spec_utils.datasource import uniprot_target_terms
+from assay_spec_utils import model
+from assay_spec_utils.datasource import uniprot_target_term_ids, chebi_names, MAX_WORKERS
 from assay_spec_utils.model import AssayProtocol, AssayTemplates, AssayAttributes, AssaySpec
 
 __all__ = [
@@ -23,26 +29,76 @@ logger = logging.getLogger(__name__)
 
 ATTRIBUTE_TERM_PREFIX = "attr:"
 
+# libyaml bindings are used if available
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+_MODEL_MTIME = os.stat(model.__file__).st_mtime_ns
+
+_ASSAY_SPECS = TypeAdapter(list[AssaySpec])
+
 
 def parse_spec(spec, validator, **kwargs):
     """Validate and parse dict-like assay spec data
     """
-    return validator(**spec).model_dump(**kwargs)
+    return validator.model_validate(spec).model_dump(**kwargs)
 
 
-def parse_spec_file(path, validator, **kwargs):
-    """Validate and parse assay spec file"""
-    with open(path) as f:
-        spec = yaml.safe_load(f)
+def _parse_spec_file(path, validator, **kwargs):
+    with open(path, "rb") as f:
+        spec = yaml.load(f, Loader=YamlLoader)
     return parse_spec(spec, validator, **kwargs)
 
 
+def _cached_parse_spec_file(path: Path, validator, cache_dir: Path, **kwargs):
+    key = (str(path.resolve()), validator.__qualname__, sorted(kwargs.items()))
+    cache_file = cache_dir / f"{hashlib.sha1(repr(key).encode()).hexdigest()}.pkl"
+    st = os.stat(path)
+    # Invalidated when either the spec file or the models are modified
+    stamp = (st.st_mtime_ns, st.st_size, _MODEL_MTIME)
+    try:
+        with open(cache_file, "rb") as f:
+            cached_stamp, spec = pickle.load(f)
+        if cached_stamp == stamp:
+            return spec
+    except (OSError, EOFError, ValueError, AttributeError, ImportError,
+            pickle.UnpicklingError):
+        pass  # Not cached yet, broken or stale
+    spec = _parse_spec_file(path, validator, **kwargs)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_file, "wb") as f:
+        pickle.dump((stamp, spec), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, cache_file)
+    return spec
+
+
+def parse_spec_file(path, validator, cache_dir=None, **kwargs):
+    """Validate and parse assay spec file
+
+    If cache_dir is given, the parsed spec is pickled there and reused
+    until the file is modified. Pickles in cache_dir are loaded as they are,
+    so it should be a trusted local directory, not a shared or published one.
+    Stale entries are not removed automatically.
+    """
+    if cache_dir is None:
+        return _parse_spec_file(path, validator, **kwargs)
+    return _cached_parse_spec_file(
+        Path(path), validator, Path(cache_dir), **kwargs)
+
+
+def _spec_files(spec_dir: Path) -> list:
+    with os.scandir(spec_dir) as it:
+        # "_" prefixed files are examples or drafts
+        names = sorted(
+            e.name for e in it
+            if e.name.endswith(".yaml") and not e.name.startswith("_"))
+    return [spec_dir / name for name in names]
+
+
 def load_protocols(protocols_dir: Path, **kwargs) -> list:
     """load assay protocol files"""
     protocols = []
-    for fpath in sorted(protocols_dir.glob("*.yaml")):
-        if fpath.name.startswith("_"):
-            continue  # Example or draft
+    for fpath in _spec_files(protocols_dir):
         logger.info(f"Protocol: {fpath.name}")
         spec = parse_spec_file(fpath, AssayProtocol, **kwargs)
         spec["protocolId"] = fpath.stem
@@ -54,9 +110,7 @@ def load_protocols(protocols_dir: Path, **kwargs) -> list:
 def load_templates(templates_dir: Path, **kwargs) -> dict:
     """load protocol template files"""
     templates = {}
-    for fpath in sorted(templates_dir.glob("*.yaml")):
-        if fpath.name.startswith("_"):
-            continue  # Example or draft
+    for fpath in _spec_files(templates_dir):
         logger.info(f"Templates: {fpath.name}")
         for tmpl in parse_spec_file(fpath, AssayTemplates, **kwargs)["items"]:
             templates[tmpl["templateId"]] = tmpl
@@ -67,9 +121,7 @@ def load_templates(templates_dir: Path, **kwargs) -> dict:
 def load_attributes(attrs_dir: Path, **kwargs) -> dict:
     """load protocol template files"""
     attributes = {}
-    for fpath in sorted(attrs_dir.glob("*.yaml")):
-        if fpath.name.startswith("_"):
-            continue  # Example or draft
+    for fpath in _spec_files(attrs_dir):
         logger.info(f"Attributes: {fpath.name}")
         for attr in parse_spec_file(fpath, AssayAttributes, **kwargs)["items"]:
             attributes[attr["attributeId"]] = attr
@@ -77,11 +129,9 @@ def load_attributes(attrs_dir: Path, **kwargs) -> dict:
     return attributes
 
 
-def _fetch_targets(spec, target_term, term_dict) -> None:
+def _collect_targets(spec, accession_ids) -> None:
     for target in spec["targets"]:
-        tgtm, tmnm = uniprot_target_terms(target["accessionId"])
-        target_term[target["accessionId"]] = tgtm
-        term_dict.update(tmnm)
+        accession_ids[target["accessionId"]] = None
 
 
 def fetch_target_terms(protocols: list, templates: dict) -> tuple[dict, dict]:
@@ -89,23 +139,31 @@ def fetch_target_terms(protocols: list, templates: dict) -> tuple[dict, dict]:
     # TODO: ncRNA, unknown gene
     target_term = {}  # UniProtID => {GOtype => [GOterms]}
     term_dict = {}  # GOterm => GOname
-    for tid, tmpl in templates.items():
-        logger.info(f"Template: {tid}")
-        _fetch_targets(tmpl, target_term, term_dict)
+    accession_ids = {}  # unique IDs in order of appearance
+    for tmpl in templates.values():
+        _collect_targets(tmpl, accession_ids)
         for readout in tmpl["readouts"]:
-            _fetch_targets(readout, target_term, term_dict)
+            _collect_targets(readout, accession_ids)
     for protocol in protocols:
-        logger.info(f"Protocol: {protocol['protocolId']}")
-        _fetch_targets(protocol, target_term, term_dict)
+        _collect_targets(protocol, accession_ids)
         for readout in protocol["readouts"]:
-            _fetch_targets(readout, target_term, term_dict)
+            _collect_targets(readout, accession_ids)
+    logger.info(f"Targets: {len(accession_ids)}")
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+        results = list(ex.map(uniprot_target_term_ids, accession_ids))
+    # ChEBI terms shared by targets are fetched once, after UniProt entries
+    chebi_name = chebi_names(
+        chain.from_iterable(tgtm["ChEBI"] for tgtm, _ in results))
+    for accession_id, (tgtm, go_name) in zip(accession_ids, results):
+        target_term[accession_id] = tgtm
+        term_dict.update((i, chebi_name[i]) for i in tgtm["ChEBI"])
+        term_dict.update(go_name)
     logger.info("Done.")
     return target_term, term_dict
 
 
 def _update_term_dict(spec, term_dict) -> None:
-    for term, name in spec["terms"]:
-        term_dict[term] = name
+    term_dict.update(spec["terms"])  # (termId, termName) pairs
 
 
 def generate_term_dict(
@@ -128,13 +186,59 @@ def generate_term_dict(
 
 
 def _resolve_attributes(spec, gattrs) -> None:
+    if spec.get("_resolved"):
+        return  # specs shared by protocols/readouts are resolved once
     spec["terms"] = [t[0] for t in spec["terms"]]
     for attrid in spec["attributes"]:
         attr = gattrs[attrid]
         # Should be unique and sorted later
-        atms = [t[0] for t in attr["terms"]]
-        spec["terms"] = [*spec["terms"], *atms, f"{ATTRIBUTE_TERM_PREFIX}{attrid}"]
-        spec["parameters"] = [*spec["parameters"], *attr["parameters"]]
+        spec["terms"].extend(t[0] for t in attr["terms"])
+        spec["terms"].append(f"{ATTRIBUTE_TERM_PREFIX}{attrid}")
+        spec["parameters"].extend(attr["parameters"])
+    spec["_resolved"] = True
+
+
+def _clone_spec(spec) -> dict:
+    # terms and parameters are extended later; other values are shared
+    return {
+        **spec,
+        "terms": list(spec["terms"]),
+        "parameters": list(spec["parameters"])
+    }
+
+
+def _build_screener(d, ridx):
+    if d["layerIndices"][ridx] is None:
+        return None  # Not measured by the readout
+    newd = {
+        "sourceType": d["sourceType"],
+        "sessionId": d["sessionId"],
+        "layerIndex": d["layerIndices"][ridx]
+    }
+    if d["subExperiments"]:
+        newd["subExperiment"] = [{
+            "subExpKey": subex["subExpKey"],
+            "subExpValue": subex["subExpValues"][ridx],
+        } for subex in d["subExperiments"]]
+    return newd
+
+
+def _build_csv(d, ridx):
+    if d["valueColumns"][ridx] is None:
+        return None  # Not measured by the readout
+    return {
+        "sourceType": d["sourceType"],
+        "sourcePath": d["sourcePath"],
+        "sampleIdColumn": d["sampleIdColumn"],
+        "valueColumn": d["valueColumns"][ridx]
+    }
+
+
+# Datasource builders for each sourceType
+_BUILDERS = {
+    "Screener": _build_screener,
+    "CSV": _build_csv
+}
 
 
 def generate_assays(
@@ -161,14 +265,15 @@ def generate_assays(
             if tmpl_id not in templates_resolved:
                 tmpl = templates[tmpl_id]
                 _resolve_attributes(tmpl, attributes)
+                # shared by protocols, so kept immutable
                 templates_resolved[tmpl_id] = {
-                    "targets": tmpl["targets"],
-                    "terms": tmpl["terms"],
-                    "parameters": tmpl["parameters"]
+                    "targets": tuple(tmpl["targets"]),
+                    "terms": tuple(tmpl["terms"]),
+                    "parameters": tuple(tmpl["parameters"])
                 }
-                templates_readouts[tmpl_id] = tmpl["readouts"]
-            spec = pickle.loads(pickle.dumps(templates_resolved[tmpl_id]))
-            readouts = pickle.loads(pickle.dumps(templates_readouts[tmpl_id]))
+                templates_readouts[tmpl_id] = tuple(tmpl["readouts"])
+            spec = _clone_spec(templates_resolved[tmpl_id])
+            readouts = templates_readouts[tmpl_id]
 
         # Override by protocol-level fields
         if protocol["targets"]:
@@ -184,71 +289,51 @@ def generate_assays(
 
         # Readouts
         for ridx, readout in enumerate(readouts):
-            sp = pickle.loads(pickle.dumps(spec))
-            ro = pickle.loads(pickle.dumps(readout))
+            sp = _clone_spec(spec)
             # Resolve targets
-            if ro["targets"]:
-                sp["targets"] = ro["targets"]
+            if readout["targets"]:
+                sp["targets"] = readout["targets"]
 
             # Override by readout-level fields
-            _resolve_attributes(ro, attributes)
-            sp["terms"].extend(ro["terms"])
-            sp["parameters"].extend(ro["parameters"])
-            sp["readoutId"] = ro["readoutId"]
-            sp["readoutMode"] = ro["readoutMode"]
-            sp["readoutRange"] = ro["readoutRange"]
+            _resolve_attributes(readout, attributes)
+            sp["terms"].extend(readout["terms"])
+            sp["parameters"].extend(readout["parameters"])
+            sp["readoutId"] = readout["readoutId"]
+            sp["readoutMode"] = readout["readoutMode"]
+            sp["readoutRange"] = readout["readoutRange"]
 
             # Assays
             for assay in protocol["assays"]:
                 #Data
                 data = []
                 for d in assay["datasources"]:
-                    newd = {"sourceType": d["sourceType"]}
-                    if d["sourceType"] == "Screener":
-                        if d["layerIndices"][ridx] is None:
-                            continue
-                        newd["sessionId"] = d["sessionId"]
-                        newd["layerIndex"] = d["layerIndices"][ridx]
-                        if d["subExperiments"]:
-                            newd["subExperiment"] = []
-                            for i, subex in enumerate(d["subExperiments"]):
-                                newd["subExperiment"].append({
-                                    "subExpKey": subex["subExpKey"],
-                                    "subExpValue": subex["subExpValues"][ridx],
-                                })
-                    elif d["sourceType"] == "CSV":
-                        if d["valueColumns"][ridx] is None:
-                            continue
-                        newd["sourcePath"] = d["sourcePath"]
-                        newd["sampleIdColumn"] = d["sampleIdColumn"]
-                        newd["valueColumn"] = d["valueColumns"][ridx]
+                    newd = _BUILDERS[d["sourceType"]](d, ridx)
+                    if newd is None:
+                        continue
                     newd["sampleMapping"] = d["sampleMapping"]
                     data.append(newd)
                 if not data:
                     continue
-                s = pickle.loads(pickle.dumps(sp))
-                asy = pickle.loads(pickle.dumps(assay))
+                s = _clone_spec(sp)
                 s["datasources"] = data
 
                 # Override by assay-level fields
-                _resolve_attributes(asy, attributes)
-                s["terms"].extend(asy["terms"])
-                s["parameters"].extend(asy["parameters"])
+                _resolve_attributes(assay, attributes)
+                s["terms"].extend(assay["terms"])
+                s["parameters"].extend(assay["parameters"])
                 # Make terms unique and sorted
                 s["terms"] = sorted(set(s["terms"]))
-                # Override parameters
-                newps = []
-                newpks = set()
-                for p in reversed(s["parameters"]):
-                    if (p[0], p[1]) not in newpks:
-                        newpks.add((p[0], p[1]))
-                        newps.append(p)
-                s["parameters"] = list(reversed(newps))
-                s["assayId"] = asy["assayId"]
-                s["valueType"] = asy["valueType"]
-
-                # Validation
-                s = parse_spec(s, AssaySpec)
+                # Override parameters (later ones take the last position)
+                newps = {}
+                for p in s["parameters"]:
+                    key = p[:2]  # (category, name)
+                    newps.pop(key, None)
+                    newps[key] = p
+                s["parameters"] = list(newps.values())
+                s["assayId"] = assay["assayId"]
+                s["valueType"] = assay["valueType"]
                 rcds.append(s)
+    # Validation (all at once)
+    rcds = _ASSAY_SPECS.dump_python(_ASSAY_SPECS.validate_python(rcds))
     logger.info("Done.")
     return rcds
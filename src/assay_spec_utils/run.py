@@ -7,6 +7,11 @@ from pathlib import Path
 
 from assay_spec_utils.parser import *
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
 PROTOCOLS_DIR = "protocols"
@@ -14,19 +19,64 @@ TEMPLATES_DIR = "templates"
 ATTRIBUTES_DIR = "attributes"
 TARGET_FILE = "targets.json.gz"
 ASSAY_FILE = "assays.json.gz"
+# Output files are regenerated often, so favor speed over size
+GZIP_COMPRESSLEVEL = 1
 
 
-def process_all(src_dir: Path, dest_dir: Path):
-    logger.info("Loading specification files...")
-    protocols = load_protocols(src_dir / PROTOCOLS_DIR)
-    templates = load_templates(src_dir / TEMPLATES_DIR)
-    attributes = load_attributes(src_dir / ATTRIBUTES_DIR)
+def _load_json_gz(path: Path):
+    """Load gzipped JSON file (orjson is used if available)"""
+    with gzip.open(path, "rb") as f:
+        if orjson is not None:
+            return orjson.loads(f.read())
+        return json.load(f)
+
+
+def _encode_json(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2).encode("UTF-8")
+
+
+def _dump_json_gz(obj: dict, path: Path, stream_key=None) -> None:
+    """Save dict as gzipped JSON file (orjson is used if available)
 
+    Items of obj[stream_key] are encoded and written one by one, so the
+    whole encoded document is not held in memory.
+    """
+    with gzip.open(path, "wb", compresslevel=GZIP_COMPRESSLEVEL) as f:
+        f.write(b"{")
+        for i, (k, v) in enumerate(obj.items()):
+            f.write(b",\n  " if i else b"\n  ")
+            f.write(_encode_json(k) + b": ")
+            if k == stream_key and v:
+                f.write(b"[")
+                for j, item in enumerate(v):
+                    f.write(b",\n    " if j else b"\n    ")
+                    f.write(_encode_json(item).replace(b"\n", b"\n    "))
+                f.write(b"\n  ]")
+            else:
+                f.write(_encode_json(v).replace(b"\n", b"\n  "))
+        f.write(b"\n}")
+
+
+def process_all(src_dir: Path, dest_dir: Path, cache_dir: Path = None):
+    """Generate target and assay files from spec files in src_dir
+
+    If cache_dir is given, parsed spec files are cached there
+    (see parse_spec_file).
+    """
+    created = datetime.now().isoformat(timespec="seconds")
     target_dest = dest_dir / TARGET_FILE
+    assay_dest = dest_dir / ASSAY_FILE
+
+    logger.info("Loading specification files...")
+    protocols = load_protocols(src_dir / PROTOCOLS_DIR, cache_dir=cache_dir)
+    templates = load_templates(src_dir / TEMPLATES_DIR, cache_dir=cache_dir)
+    attributes = load_attributes(src_dir / ATTRIBUTES_DIR, cache_dir=cache_dir)
+
     if target_dest.exists():
         logger.info("Loading target file...")
-        with gzip.open(target_dest, "rt", encoding='UTF-8') as f:
-            target_json = json.load(f)
+        target_json = _load_json_gz(target_dest)
         logger.info(f"Loaded: {target_dest}")
         targets = target_json["targets"]
         target_terms = target_json["terms"]
@@ -35,13 +85,12 @@ def process_all(src_dir: Path, dest_dir: Path):
         targets, target_terms = fetch_target_terms(protocols, templates)
         target_json = {
             "meta": {
-                "created": datetime.now().isoformat(timespec="seconds")
+                "created": created
             },
             "targets": targets,
             "terms": target_terms
         }
-        with gzip.open(target_dest, "wt", encoding='UTF-8') as f:
-            json.dump(target_json, f, indent=2)
+        _dump_json_gz(target_json, target_dest)
         logger.info(f"Saved: {target_dest}")
 
     logger.info("Creating a term dictionary...")
@@ -52,12 +101,11 @@ def process_all(src_dir: Path, dest_dir: Path):
     assays = generate_assays(protocols, templates, attributes, targets)
     assay_json = {
         "meta": {
-            "created": datetime.now().isoformat(timespec="seconds")
+            "created": created
         },
         "assays": assays,
         "targets": targets,
         "terms": terms
     }
-    with gzip.open(dest_dir / ASSAY_FILE, "wt", encoding='UTF-8') as f:
-        json.dump(assay_json, f, indent=2)
-    logger.info(f"Saved: {dest_dir / ASSAY_FILE}")
+    _dump_json_gz(assay_json, assay_dest, stream_key="assays")
+    logger.info(f"Saved: {assay_dest}")
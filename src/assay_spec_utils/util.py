@@ -1,22 +1,25 @@
 
 
+# Concentration unit => (factor, base unit)
+CONC_FACTORS = {
+    "M": (1, "M"), "mM": (1e-3, "M"), "uM": (1e-6, "M"), "nM": (1e-9, "M"),
+    "pM": (1e-12, "M"),
+    "g/L": (1, "g/L"), "mg/L": (1e-3, "g/L"), "ug/L": (1e-6, "g/L"),
+    "ng/L": (1e-9, "g/L"), "pg/L": (1e-12, "g/L"),
+    "mg/mL": (1, "g/L"), "ug/mL": (1e-3, "g/L"), "ng/mL": (1e-6, "g/L"),
+    "pg/mL": (1e-9, "g/L"),
+    "ug/uL": (1, "g/L"), "ng/uL": (1e-3, "g/L"), "pg/uL": (1e-6, "g/L")
+}
+
+
 def convert_conc_units(value: float, unit: str)-> tuple[float, str]:
     """Convert concentration values to their base units (M, g/L or ratio).
     """
     if value < 0:
         raise ValueError("concentration should be a positive value")
-    mol_factor = dict(
-        M=1, mM=1e-3, uM=1e-6, nM=1e-9, pM=1e-12
-    )
-    gl_factor = {
-        "g/L": 1, "mg/L": 1e-3, "ug/L": 1e-6, "ng/L": 1e-9, "pg/L": 1e-12,
-        "mg/mL": 1, "ug/mL": 1e-3, "ng/mL": 1e-6, "pg/mL": 1e-9,
-        "ug/uL": 1, "ng/uL": 1e-3, "pg/uL": 1e-6
-    }
-    if unit in mol_factor.keys():
-        return (value * mol_factor[unit], "M")
-    elif unit in gl_factor():
-        return (value * gl_factor[unit], "g/L")
+    if unit in CONC_FACTORS:
+        factor, base_unit = CONC_FACTORS[unit]
+        return (value * factor, base_unit)
     elif unit == r"v/v%":
         if value > 100 or value < 0:
             raise ValueError(r"v/v% should be in the range of 0-100")
@@ -1,7 +1,10 @@
 import os
 from pathlib import Path
+import pickle
+import shutil
 
 from assay_spec_utils.parser import *
+from assay_spec_utils.model import AssayProtocol
 from assay_spec_utils.parser import _resolve_attributes
 BASE_DIR = Path("./example")
 
@@ -36,3 +39,52 @@ def test_resolve_attributes():
     _resolve_attributes(spec, attrs)
     assert spec["terms"] == ["t4", "t1", "t2", "t3"]
     assert spec["parameters"] == dict(p1=10, p2="value", p3=1.23, p4="hoge")
+
+
+def test_resolve_attributes_once():
+    attrs = dict(
+        test1=dict(
+            terms=[("t1", "hogehoge")],
+            parameters=[("time", "p1", 10, "min")]
+        )
+    )
+    spec = dict(
+        attributes=["test1"],
+        terms=[("t2", "fuga")],
+        parameters=[]
+    )
+    _resolve_attributes(spec, attrs)
+    _resolve_attributes(spec, attrs)
+    assert spec["terms"] == ["t2", "t1", "attr:test1"]
+    assert spec["parameters"] == [("time", "p1", 10, "min")]
+
+
+
+def test_parse_spec_file_cache(tmp_path):
+    fpath = BASE_DIR / "protocols" / "p53_Mdm2_HTRF.yaml"
+    spec = parse_spec_file(fpath, AssayProtocol)
+    assert parse_spec_file(fpath, AssayProtocol, cache_dir=tmp_path) == spec
+    # Cache hit
+    pkl, = tmp_path.glob("*.pkl")
+    with open(pkl, "rb") as f:
+        stamp, _ = pickle.load(f)
+    with open(pkl, "wb") as f:
+        pickle.dump((stamp, "cached"), f)
+    assert parse_spec_file(fpath, AssayProtocol, cache_dir=tmp_path) == "cached"
+    # Stale pickle referring to a missing module
+    pkl.write_bytes(b"cnonexistent_module\nSpec\n.")
+    assert parse_spec_file(fpath, AssayProtocol, cache_dir=tmp_path) == spec
+
+
+def test_parse_spec_file_cache_invalidation(tmp_path):
+    cache_dir = tmp_path / "cache"
+    fpath = tmp_path / "p53_Mdm2_HTRF.yaml"
+    shutil.copy(BASE_DIR / "protocols" / fpath.name, fpath)
+    spec = parse_spec_file(fpath, AssayProtocol, cache_dir=cache_dir)
+    assert spec["templateId"] == "HTRF_TB_D2"
+    # Modified file is parsed again
+    st = os.stat(fpath)
+    fpath.write_text(fpath.read_text().replace("HTRF_TB_D2", "HTRF_TB_D2_mod"))
+    os.utime(fpath, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    spec = parse_spec_file(fpath, AssayProtocol, cache_dir=cache_dir)
+    assert spec["templateId"] == "HTRF_TB_D2_mod"
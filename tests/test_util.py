@@ -0,0 +1,11 @@
+import pytest
+
+from assay_spec_utils.util import convert_conc_units
+
+
+def test_convert_conc_units():
+    assert convert_conc_units(10, "uM") == pytest.approx((1e-5, "M"))
+    assert convert_conc_units(5, "ng/mL") == pytest.approx((5e-6, "g/L"))
+    assert convert_conc_units(1, "v/v%") == pytest.approx((0.01, "ratio"))
+    with pytest.raises(ValueError):
+        convert_conc_units(1, "mol")